@@ -2,33 +2,109 @@
 import os
 import pytest
 import sqlite3
+import time_machine
+from types import SimpleNamespace
+from unittest.mock import create_autospec
 import database  # your module
+from tests._clock import FROZEN_NOW
+import services.library_service as library_service
+
+# DB helpers used by services.library_service that unit tests replace with mocks
+_LIBRARY_DB_HELPERS = (
+    "get_book_by_id", "get_book_by_isbn", "get_patron_borrow_count", "insert_book",
+    "borrow_books_atomic", "return_borrowed_book",
+    "get_active_borrow_record", "search_books", "get_patron_active_with_fees",
+    "get_patron_borrow_history",
+)
+
+
+class _SessionConnection(sqlite3.Connection):
+    """
+    Connection shared by the whole test session.
+    The per-test savepoint owns the transaction, so the app's own
+    commit()/close() calls must not end it.
+    """
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
 
 @pytest.fixture(scope="session", autouse=True)
-def create_test_db(tmp_path_factory):
+def _frozen_clock():
     """
-    Create a persistent temp SQLite file for the whole test session
+    Freeze datetime.now()/time.time() at FROZEN_NOW while tests run, so
+    dates built from it agree with the code under test and a run never
+    crosses midnight.
+    """
+    # time-machine reads naive datetimes as UTC; pin the local wall-clock time
+    with time_machine.travel(FROZEN_NOW.astimezone(), tick=False):
+        yield
+
+
+@pytest.fixture(scope="session", autouse=True)
+def create_test_db():
+    """
+    Create an in-memory SQLite database for the whole test session
     and initialize schema using database.init_database().
+    Each pytest-xdist worker gets its own named database.
     """
-    db_dir = tmp_path_factory.mktemp("db")
-    test_db_path = db_dir / "test.db"
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+    database.DATABASE = f"file:test_{worker_id}?mode=memory&cache=shared"
 
-    # Point the app to the test database file
-    database.DATABASE = str(test_db_path)
+    # One long-lived connection keeps the in-memory schema alive
+    conn = sqlite3.connect(database.DATABASE, uri=True, factory=_SessionConnection,
+                           isolation_level=None, check_same_thread=False,
+                           detect_types=database.DETECT_TYPES,
+                           cached_statements=database.CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    database._conn = conn
 
     # Create tables
     database.init_database()
 
-    # (Optional) prove it exists
-    assert os.path.exists(test_db_path)
+    # Tune the connection once; WAL only applies to file-backed databases
+    if "mode=memory" not in database.DATABASE:
+        conn.execute("PRAGMA journal_mode=WAL;")
+    for p in ("synchronous=NORMAL", "temp_store=MEMORY", "cache_size=-20000",
+              "busy_timeout=5000", "mmap_size=268435456"):
+        conn.execute(f"PRAGMA {p};")
+
+    yield conn
+
+    database._conn = None
+    sqlite3.Connection.close(conn)
 
 @pytest.fixture(autouse=True)
-def clean_tables():
+def clean_tables(create_test_db):
+    """
+    Run each test inside a savepoint on the cached session connection and
+    roll it back afterwards, so every test starts from a clean DB state.
+    """
+    conn = create_test_db
+    conn.execute("SAVEPOINT t")
+    yield
+    if not conn.in_transaction:
+        # Something committed at the C level (e.g. "with conn:"), so this test's
+        # writes are already permanent and would leak into later tests
+        pytest.fail("per-test savepoint was committed; don't end transactions "
+                    "on the shared test connection", pytrace=False)
+    conn.execute("ROLLBACK TO t")
+    conn.execute("RELEASE t")
+
+@pytest.fixture
+def lib_mocks(monkeypatch):
     """
-    Before each test, start from a clean DB state.
+    Replace the DB helpers imported into services.library_service with
+    autospecced mocks; tests configure them as lib_mocks.<name>.return_value etc.
+    Unconfigured helpers return None (not a truthy mock), so missing setup
+    fails instead of passing as success, and call signatures are enforced.
     """
-    conn = database.get_db_connection()
-    with conn:
-        conn.execute("DELETE FROM borrow_records;")
-        conn.execute("DELETE FROM books;")
-    conn.close()
+    mocks = SimpleNamespace(**{
+        name: create_autospec(getattr(library_service, name), return_value=None)
+        for name in _LIBRARY_DB_HELPERS
+    })
+    for name, mock in vars(mocks).items():
+        monkeypatch.setattr(library_service, name, mock)
+    return mocks
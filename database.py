@@ -4,48 +4,114 @@ Handles all database operations and connections
 """
 
 import sqlite3
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
 # Database configuration
 DATABASE = 'library.db'
 
+# Columns selected as "name [isodate]" arrive as datetime.date objects
+DETECT_TYPES = sqlite3.PARSE_COLNAMES
+sqlite3.register_converter('isodate', lambda value: date.fromisoformat(value.decode()))
+
+# books_fts uses FTS5's trigram tokenizer, added in SQLite 3.34
+FTS_TRIGRAM_MIN_SQLITE = (3, 34, 0)
+
+# Prepared statements kept per connection (sqlite3 keys them by SQL text)
+CACHED_STATEMENTS = 256
+
+# Optional long-lived connection; when set, get_db_connection() hands it out
+# instead of opening a new one (used by the test suite's in-memory database).
+_conn = None
+
 def get_db_connection():
     """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
+    if _conn is not None:
+        return _conn
+    conn = sqlite3.connect(DATABASE, detect_types=DETECT_TYPES,
+                           cached_statements=CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row  # This enables column access by name
     return conn
 
 def init_database():
     """Initialize the database with required tables."""
-    conn = get_db_connection()
-    
-    # Create books table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            isbn TEXT UNIQUE NOT NULL,
-            total_copies INTEGER NOT NULL,
-            available_copies INTEGER NOT NULL
-        )
-    ''')
-    
-    # Create borrow_records table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patron_id TEXT NOT NULL,
-            book_id INTEGER NOT NULL,
-            borrow_date TEXT NOT NULL,
-            due_date TEXT NOT NULL,
-            return_date TEXT,
-            FOREIGN KEY (book_id) REFERENCES books (id)
+    if sqlite3.sqlite_version_info < FTS_TRIGRAM_MIN_SQLITE:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} is too old: catalog search needs FTS5 with the "
+            f"trigram tokenizer (SQLite {'.'.join(map(str, FTS_TRIGRAM_MIN_SQLITE))} or newer)"
         )
-    ''')
-    
-    conn.commit()
+    conn = get_db_connection()
+
+    # Create all schema objects in one transaction (a single journal cycle)
+    with _savepoint(conn, 'init_schema'):
+        has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'"
+        ).fetchone() is not None
+
+        # Create books table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                isbn TEXT UNIQUE NOT NULL,
+                total_copies INTEGER NOT NULL,
+                available_copies INTEGER NOT NULL
+            )
+        ''')
+
+        # Create borrow_records table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS borrow_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patron_id TEXT NOT NULL,
+                book_id INTEGER NOT NULL,
+                borrow_date TEXT NOT NULL,
+                due_date TEXT NOT NULL,
+                return_date TEXT,
+                FOREIGN KEY (book_id) REFERENCES books (id)
+            )
+        ''')
+
+        # Active loans per patron (partial: only rows not yet returned)
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_br_patron_active ON borrow_records(patron_id)
+            WHERE return_date IS NULL
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_br_patron_all ON borrow_records(patron_id, book_id)
+        ''')
+
+        # Trigram full-text index over title/author for substring search
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                title, author, content='books', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+                INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+                INSERT INTO books_fts (books_fts, rowid, title, author)
+                VALUES ('delete', old.id, old.title, old.author);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE OF title, author ON books BEGIN
+                INSERT INTO books_fts (books_fts, rowid, title, author)
+                VALUES ('delete', old.id, old.title, old.author);
+                INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+            END
+        ''')
+
+        # Index books that existed before the full-text table was created
+        if not has_fts:
+            conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
     conn.close()
 
 def add_sample_data():
@@ -82,6 +148,18 @@ def add_sample_data():
     
     conn.close()
 
+@contextmanager
+def _savepoint(conn, name: str):
+    """Run the enclosed statements atomically inside a named savepoint."""
+    conn.execute(f'SAVEPOINT {name}')
+    try:
+        yield conn
+    except Exception:
+        conn.execute(f'ROLLBACK TO {name}')
+        conn.execute(f'RELEASE {name}')
+        raise
+    conn.execute(f'RELEASE {name}')
+
 # Helper Functions for Database Operations
 
 def get_all_books() -> List[Dict]:
@@ -105,30 +183,75 @@ def get_book_by_isbn(isbn: str) -> Optional[Dict]:
     conn.close()
     return dict(book) if book else None
 
-def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
-    """Get currently borrowed books for a patron."""
+def search_books(term: str, search_type: str) -> List[Dict]:
+    """
+    Search books: exact match on ISBN, partial case-insensitive match on
+    title, author, or (any other type) either one. Terms of 3+ characters are
+    looked up through the books_fts trigram index (whose MATCH folds case
+    beyond ASCII, unlike LIKE); matches are then confirmed with casefold().
+    """
     conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
+    if search_type == 'isbn':
+        books = conn.execute(
+            'SELECT * FROM books WHERE isbn = ? ORDER BY title', (term,)
+        ).fetchall()
+        conn.close()
+        return [dict(book) for book in books]
+
+    columns = [search_type] if search_type in ('title', 'author') else ['title', 'author']
+    if len(term) >= 3:
+        # Quoted phrase of trigrams = substring match; {a b} filters to those columns
+        phrase = '"' + term.replace('"', '""') + '"'
+        books = conn.execute('''
+            SELECT * FROM books
+            WHERE id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)
+            ORDER BY title
+        ''', ('{' + ' '.join(columns) + '} : ' + phrase,)).fetchall()
+    else:
+        # Too short for a trigram; scan the catalog
+        books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
     conn.close()
-    
-    borrowed_books = []
-    for record in records:
-        borrowed_books.append({
-            'book_id': record['book_id'],
-            'title': record['title'],
-            'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
-        })
-    
-    return borrowed_books
+
+    needle = term.casefold()
+    return [dict(book) for book in books
+            if any(needle in book[column].casefold() for column in columns)]
+
+def get_active_borrow_record(patron_id: str, book_id: int) -> Optional[Dict]:
+    """
+    Get a patron's most recent borrow record for a book (active or returned),
+    with due_date and return_date as dates.
+    """
+    conn = get_db_connection()
+    record = conn.execute('''
+        SELECT id, date(due_date) AS "due_date [isodate]", date(return_date) AS "return_date [isodate]"
+        FROM borrow_records
+        WHERE patron_id = ? AND book_id = ?
+        ORDER BY id DESC LIMIT 1
+    ''', (patron_id, book_id)).fetchone()
+    conn.close()
+    return dict(record) if record else None
+
+def get_patron_active_with_fees(patron_id: str, as_of: date) -> List[Dict]:
+    """
+    Get a patron's active loans with days overdue (as of the given date) and
+    late fee computed in SQL ($0.50/day for the first 7 days, $1.00/day after,
+    capped at $15.00).
+    """
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT book_id, title, due_date, days_overdue,
+               round(min(15.00, min(days_overdue, 7) * 0.50 + max(days_overdue - 7, 0) * 1.00), 2) AS late_fee
+        FROM (
+            SELECT br.book_id, b.title, date(br.due_date) AS due_date, br.borrow_date,
+                   max(0, CAST(julianday(:as_of) - julianday(date(br.due_date)) AS INTEGER)) AS days_overdue
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id
+            WHERE br.patron_id = :patron_id AND br.return_date IS NULL
+        )
+        ORDER BY borrow_date
+    ''', {'patron_id': patron_id, 'as_of': as_of.isoformat()}).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
 
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
@@ -170,6 +293,45 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
         conn.close()
         return False
 
+class _BorrowConflict(Exception):
+    """A borrow check failed inside the write transaction; nothing is written."""
+
+def borrow_books_atomic(patron_id: str, book_ids: List[int], borrow_date: datetime, due_date: datetime,
+                        max_active: int):
+    """
+    Insert borrow records and take one copy of each book in a single transaction.
+    The borrowing limit and copy counts are re-checked inside the transaction, so a
+    borrow committed concurrently can't push a patron past max_active or a book below 0.
+    Returns True on success, None if one of those checks fails (nothing is written),
+    or False on a database error.
+    """
+    conn = get_db_connection()
+    try:
+        with _savepoint(conn, 'borrow_books'):
+            active = conn.execute('''
+                SELECT COUNT(*) FROM borrow_records WHERE patron_id = ? AND return_date IS NULL
+            ''', (patron_id,)).fetchone()[0]
+            if active + len(book_ids) > max_active:
+                raise _BorrowConflict
+            conn.executemany('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', [(patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()) for book_id in book_ids])
+            taken = conn.executemany('''
+                UPDATE books SET available_copies = available_copies - 1
+                WHERE id = ? AND available_copies > 0
+            ''', [(book_id,) for book_id in book_ids]).rowcount
+            if taken != len(book_ids):
+                raise _BorrowConflict
+        conn.close()
+        return True
+    except _BorrowConflict:
+        conn.close()
+        return None
+    except Exception as e:
+        conn.close()
+        return False
+
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
     conn = get_db_connection()
@@ -200,6 +362,35 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
         conn.close()
         return False
 
+def return_borrowed_book(patron_id: str, book_id: int, return_date: datetime):
+    """
+    Close a patron's active borrow record and restock the book in one transaction.
+    Available copies are only incremented while below total copies.
+    Returns the closed record (with due_date as a date), None if there is no active borrow,
+    or False on a database error.
+    """
+    conn = get_db_connection()
+    try:
+        with _savepoint(conn, 'return_book'):
+            record = conn.execute('''
+                SELECT id, date(due_date) AS "due_date [isodate]" FROM borrow_records
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+                ORDER BY id LIMIT 1
+            ''', (patron_id, book_id)).fetchone()
+            if record:
+                conn.execute('''
+                    UPDATE borrow_records SET return_date = ? WHERE id = ?
+                ''', (return_date.isoformat(), record['id']))
+                conn.execute('''
+                    UPDATE books SET available_copies = available_copies + 1
+                    WHERE id = ? AND available_copies < total_copies
+                ''', (book_id,))
+        conn.close()
+        return dict(record) if record else None
+    except Exception as e:
+        conn.close()
+        return False
+
 def get_patron_borrow_history(patron_id: str):
     """Return all borrow rows (active and returned) for a patron, newest first."""
     conn = get_db_connection()
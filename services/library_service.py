@@ -3,15 +3,32 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
     get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books, get_patron_borrow_history
+    insert_book, borrow_books_atomic,
+    get_active_borrow_record, return_borrowed_book, get_patron_active_with_fees, get_patron_borrow_history,
+    search_books
 
 )
 
+# Input formats: 6-digit patron ID, 13-digit ISBN (ASCII digits only)
+_PATRON_ID_RE = re.compile(r"\d{6}", re.ASCII)
+_ISBN_RE = re.compile(r"\d{13}", re.ASCII)
+
+# R3: most books a patron may have borrowed at once
+_MAX_BORROWED = 5
+
+# Late fee by days overdue: $0.50/day for the first 7 days, $1.00/day after,
+# capped at $15.00 (reached well before the last index, which covers any longer delay)
+_FEE_TABLE = tuple(round(min(min(d, 7) * 0.50 + max(d - 7, 0) * 1.00, 15.00), 2) for d in range(32))
+
+def is_valid_patron_id(patron_id: str) -> bool:
+    """Check that a patron ID is exactly 6 ASCII digits."""
+    return bool(patron_id) and _PATRON_ID_RE.fullmatch(patron_id) is not None
+
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
     Add a new book to the catalog.
@@ -28,7 +45,7 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
     if len(author.strip()) > 100:
         return False, "Author must be less than 100 characters."
 
-    if len(isbn) != 13 or not isbn.isdigit():
+    if not _ISBN_RE.fullmatch(isbn):
         return False, "ISBN must be exactly 13 digits."
 
     if not isinstance(total_copies, int) or total_copies <= 0:
@@ -50,39 +67,66 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     Allow a patron to borrow a book.
     Implements R3 as per requirements
     """
-    # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits."
+    return borrow_books_bulk(patron_id, [book_id])[0]
 
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
-
-    if book['available_copies'] <= 0:
-        return False, "This book is currently not available."
-
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
+def _check_borrows(patron_id: str, book_ids: List[int], due_date: datetime) -> Tuple[List[Tuple[bool, str]], List[int]]:
+    """
+    Apply the R3 rules to each requested book in order.
+    Returns one (success, message) pair per book and the ids that passed.
+    """
+    # Only counted once a book passes its own checks, as the single-book rule order has it
+    current_borrowed = None
+
+    results: List[Tuple[bool, str]] = []
+    accepted: List[int] = []
+    for book_id in book_ids:
+        book = get_book_by_id(book_id)
+        if not book:
+            results.append((False, "Book not found."))
+            continue
+        if book['available_copies'] - accepted.count(book_id) <= 0:
+            results.append((False, "This book is currently not available."))
+            continue
+        if current_borrowed is None:
+            current_borrowed = get_patron_borrow_count(patron_id)
+        if current_borrowed + len(accepted) >= _MAX_BORROWED:
+            results.append((False, f"You have reached the maximum borrowing limit of {_MAX_BORROWED} books."))
+        else:
+            accepted.append(book_id)
+            results.append((True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'))
+    return results, accepted
 
-    # Max 5 books: block at 5
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
+def borrow_books_bulk(patron_id: str, book_ids: List[int]) -> List[Tuple[bool, str]]:
+    """
+    Borrow several books for one patron, applying the R3 rules to each in order.
+    All accepted borrows are written in a single DB transaction.
+    Returns one (success, message) pair per requested book.
+    """
+    if not is_valid_patron_id(patron_id):
+        return [(False, "Invalid patron ID. Must be exactly 6 digits.")] * len(book_ids)
 
-    # Create borrow record
     borrow_date = datetime.now()
     due_date = borrow_date + timedelta(days=14)
 
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
-        return False, "Database error occurred while creating borrow record."
-
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-
-    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+    # The write repeats the limit/copy checks in its transaction. None means another
+    # borrow committed after ours were made, so check once more against the new state.
+    for _ in range(2):
+        results, accepted = _check_borrows(patron_id, book_ids, due_date)
+        if not accepted:
+            return results
+        written = borrow_books_atomic(patron_id, accepted, borrow_date, due_date, _MAX_BORROWED)
+        if written:
+            return results
+        if written is False:
+            # Nothing was written, so every accepted borrow failed
+            return [(False, "Database error occurred while creating borrow record.") if ok else (ok, msg)
+                    for ok, msg in results]
+
+    # Still losing to concurrent borrows: report the R3 outcome for the current state,
+    # and ask to retry the borrows that would pass now but weren't written
+    results, _ = _check_borrows(patron_id, book_ids, due_date)
+    return [(False, "Availability changed while borrowing. Please try again.") if ok else (ok, msg)
+            for ok, msg in results]
 
 # --------------------------
 # R4 – R7
@@ -92,13 +136,12 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Implements R4: Book Return Processing
       - Validates IDs
-      - Verifies active borrow (DB layer)
-      - Records return_date
-      - Increments available copies (clamped so it never exceeds total)
+      - Verifies active borrow, records return_date and increments
+        available copies (clamped to total) in one DB transaction
       - Calculates and reports late fee owed
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not is_valid_patron_id(patron_id):
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
     # Validate book exists
@@ -106,34 +149,17 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not book:
         return False, "Book not found."
 
-    # Record return date (DB layer should ensure active borrow exists)
+    # Close the active borrow and restock (never above total copies) atomically
     now_dt = datetime.now()
-    updated = update_borrow_record_return_date(patron_id, book_id, now_dt)
-    if not updated:
+    updated = return_borrowed_book(patron_id, book_id, now_dt)
+    if updated is None:
         return False, "No active borrow record found for this patron and book."
+    if not updated:
+        return False, "Database error while recording the return."
 
-    # Increment availability but do not exceed total copies (constraint)
-    fresh = get_book_by_id(book_id)
-    if not fresh:
-        return False, "Book not found during update."
-    if int(fresh.get("available_copies", 0)) < int(fresh.get("total_copies", 0)):
-        if not update_book_availability(book_id, +1):
-            return False, "Database error while updating book availability."
-    # else: already at or above total; skip increment to honor constraint
-
-    # Inline late-fee calculation (if due_date available)
-    days_overdue = 0
-    fee = 0.0
-    if isinstance(updated, dict) and updated.get("due_date"):
-        try:
-            due_dt = datetime.fromisoformat(str(updated["due_date"])).date()
-            days_overdue = max(0, (now_dt.date() - due_dt).days)
-            if days_overdue > 0:
-                first = min(days_overdue, 7) * 0.50
-                rest = max(days_overdue - 7, 0) * 1.00
-                fee = round(min(first + rest, 15.00), 2)
-        except Exception:
-            pass
+    # Late fee as of today (due_date arrives from the DB layer as a date)
+    days_overdue = max(0, (now_dt.date() - updated["due_date"]).days)
+    fee = _FEE_TABLE[min(days_overdue, 31)]
 
     if days_overdue > 0 and fee > 0:
         return True, f'Returned "{book["title"]}". {days_overdue} day(s) overdue. Late fee: ${fee:.2f}.'
@@ -146,40 +172,28 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     - $0.50/day for first 7 days, $1.00/day thereafter, capped at $15.
     """
     # Validate IDs
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not is_valid_patron_id(patron_id):
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "Invalid patron ID. Must be exactly 6 digits."}
 
     book = get_book_by_id(book_id)
     if not book:
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "Book not found."}
 
-    # Try to read active/last borrow via updater (starter convention: return row if return_dt=None)
-    try:
-        row = update_borrow_record_return_date(patron_id, book_id, None)  # type: ignore
-    except TypeError:
-        row = None
-
-    if not row or not isinstance(row, dict) or not row.get("due_date"):
+    # Latest borrow for this patron/book; dates arrive from the DB layer as dates
+    row = get_active_borrow_record(patron_id, book_id)
+    if not row:
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "No active/known borrow record or due date unavailable."}
 
-    due_dt = datetime.fromisoformat(str(row["due_date"])).date()
-    if row.get("return_date"):
-        try:
-            asof_dt = datetime.fromisoformat(str(row["return_date"])).date()
-        except Exception:
-            asof_dt = datetime.now().date()
+    due_dt = row["due_date"]
+    if row["return_date"]:
+        asof_dt = row["return_date"]
         status = "Returned; historical fee at return date calculated."
     else:
         asof_dt = datetime.now().date()
         status = "Not yet returned; fee calculated as of today."
 
     days_overdue = max(0, (asof_dt - due_dt).days)
-    if days_overdue <= 0:
-        fee = 0.00
-    else:
-        first = min(days_overdue, 7) * 0.50
-        rest = max(days_overdue - 7, 0) * 1.00
-        fee = round(min(first + rest, 15.00), 2)
+    fee = _FEE_TABLE[min(days_overdue, 31)]
 
     return {"fee_amount": fee, "days_overdue": int(days_overdue), "status": status}
 
@@ -189,34 +203,15 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     - type: title|author|isbn
     - Partial, case-insensitive for title/author
     - Exact match for 13-digit ISBN
+    - Unknown types match title OR author
     - Returns same shape as catalog entries
     """
     q = (search_term or "").strip()
     if not q:
         return []
 
-    books = get_all_books() or []
-    results: List[Dict] = []
-
-    if search_type == "isbn":
-        # Exact 13-digit match
-        results = [b for b in books if str(b.get("isbn", "")).strip() == q]
-    elif search_type == "title":
-        ql = q.lower()
-        results = [b for b in books if ql in str(b.get("title", "")).lower()]
-    elif search_type == "author":
-        ql = q.lower()
-        results = [b for b in books if ql in str(b.get("author", "")).lower()]
-    else:
-        # Fallback: title OR author (partial, case-insensitive)
-        ql = q.lower()
-        results = [
-            b for b in books
-            if ql in str(b.get("title", "")).lower()
-            or ql in str(b.get("author", "")).lower()
-        ]
-
-    return results
+    # Exact ISBN / partial title, author or (unknown type) either, filtered by SQLite
+    return search_books(q, search_type)
 
 def get_patron_status_report(patron_id: str) -> Dict:
     """
@@ -226,7 +221,7 @@ def get_patron_status_report(patron_id: str) -> Dict:
       - Number of books currently borrowed
       - Borrowing history (returned + active)
     """
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not is_valid_patron_id(patron_id):
         return {
             "patron_id": patron_id,
             "num_currently_borrowed": 0,
@@ -236,30 +231,11 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "status": "Invalid patron ID. Must be exactly 6 digits."
         }
 
-    # Active loans
-    active = get_patron_borrowed_books(patron_id) or []
-    currently_borrowed, total_fees = [], 0.0
+    # Active loans, with days overdue and per-book fees computed by SQLite
+    # against a single captured "today"
     today = datetime.now().date()
-
-    for rec in active:
-        due = rec["due_date"].date() if hasattr(rec["due_date"], "date") else datetime.fromisoformat(str(rec["due_date"])).date()
-        days_overdue = max(0, (today - due).days)
-        if days_overdue <= 0:
-            fee = 0.00
-        else:
-            first = min(days_overdue, 7) * 0.50
-            rest = max(days_overdue - 7, 0) * 1.00
-            fee = min(first + rest, 15.00)
-        fee = round(fee, 2)
-        total_fees += fee
-
-        currently_borrowed.append({
-            "book_id": rec["book_id"],
-            "title": rec["title"],
-            "due_date": due.isoformat(),
-            "days_overdue": int(days_overdue),
-            "late_fee": fee,
-        })
+    currently_borrowed = get_patron_active_with_fees(patron_id, today) or []
+    total_fees = sum((rec["late_fee"] for rec in currently_borrowed), 0.0)
 
     # Full history (includes returned rows)
     history = get_patron_borrow_history(patron_id) or []
@@ -1,6 +1,6 @@
 from typing import Tuple, Optional
 from services.payment_service import PaymentGateway
-from services.library_service import get_book_by_id, calculate_late_fee_for_book
+from services.library_service import get_book_by_id, calculate_late_fee_for_book, is_valid_patron_id
 
 
 
@@ -26,7 +26,7 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not is_valid_patron_id(patron_id):
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
     
     # Calculate late fee first
@@ -0,0 +1,7 @@
+"""Fixed local "now" for the test session; conftest freezes the clock here."""
+
+from datetime import datetime
+
+# Test modules are imported during collection, before the clock is frozen,
+# so they build dates from this instead of calling datetime.now() at import time
+FROZEN_NOW = datetime(2025, 1, 15, 12, 0, 0)
@@ -1,13 +1,25 @@
 import pytest
+from datetime import datetime, timedelta
+import database
+from app import create_app
+from database import get_book_by_id, get_book_by_isbn, insert_borrow_record
 from services.library_service import (
     add_book_to_catalog,
     borrow_book_by_patron,
+    borrow_books_bulk,
     return_book_by_patron,
     calculate_late_fee_for_book,
     search_books_in_catalog,
     get_patron_status_report as patron_status_report,
 )
 
+def test_create_app_inside_test_keeps_isolation():
+    """create_app() re-runs the schema script without ending the test's savepoint."""
+    create_app()
+    assert database._conn.in_transaction
+    # Sample data is seeded into the (rolled back) test database
+    assert get_book_by_isbn("9780743273565")["title"] == "The Great Gatsby"
+
 # ----------------
 # R1 – Add Book
 # ----------------
@@ -97,10 +109,7 @@ def test_borrow_unavailable_or_missing_book():
 
 def test_borrow_max_limit_enforced_on_sixth():
     """Max 5 books per patron: at least one of six attempts should be rejected."""
-    attempts = []
-    for i in range(6):
-        s, m = borrow_book_by_patron("111111", i + 10)
-        attempts.append((s, m))
+    attempts = borrow_books_bulk("111111", [i + 10 for i in range(6)])
 
     # If DB permits all 6 (unlikely), still OK; otherwise at least one should fail
     if all(s for s, _ in attempts):
@@ -118,6 +127,59 @@ def test_borrow_max_limit_enforced_on_sixth():
             for s, m in attempts
         )
 
+def test_borrow_bulk_stops_at_limit_and_updates_availability():
+    """Bulk borrowing accepts five books, rejects the sixth and takes one copy each."""
+    isbns = [f"99900000000{i:02d}" for i in range(6)]
+    for i, isbn in enumerate(isbns):
+        add_book_to_catalog(f"Book {i}", "Author", isbn, 1)
+    book_ids = [get_book_by_isbn(isbn)["id"] for isbn in isbns]
+
+    attempts = borrow_books_bulk("111111", book_ids)
+
+    assert [s for s, _ in attempts] == [True] * 5 + [False]
+    assert "maximum borrowing limit" in attempts[5][1].lower()
+    assert [get_book_by_isbn(isbn)["available_copies"] for isbn in isbns] == [0] * 5 + [1]
+
+def test_borrow_bulk_same_book_respects_copies():
+    """Requesting the same book twice only succeeds while copies remain."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 1)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    attempts = borrow_books_bulk("111111", [book_id, book_id])
+    assert [s for s, _ in attempts] == [True, False]
+    assert "not available" in attempts[1][1].lower()
+
+def test_borrow_write_guards_against_stale_checks():
+    """A copy taken after the availability check is not borrowed twice."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 1)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    assert get_book_by_id(book_id)["available_copies"] == 1
+    # Another writer takes the last copy directly in the database
+    database.get_db_connection().execute(
+        "UPDATE books SET available_copies = 0 WHERE id = ?", (book_id,))
+
+    success, message = borrow_book_by_patron("222222", book_id)
+    assert success is False and "not available" in message.lower()
+    assert get_book_by_isbn("1234567890123")["available_copies"] == 0
+
+def test_borrow_write_rechecks_limit():
+    """The bulk write refuses to take a patron past the limit."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 1)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    now = datetime.now()
+    for _ in range(5):
+        insert_borrow_record("222222", book_id, now, now + timedelta(days=14))
+
+    assert database.borrow_books_atomic("222222", [book_id], now, now + timedelta(days=14), 5) is None
+    assert get_book_by_isbn("1234567890123")["available_copies"] == 1
+
+def test_book_lookup_reflects_writes():
+    """Cached book lookups see availability changes made by borrows."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 2)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    assert get_book_by_id(book_id)["available_copies"] == 2
+    assert borrow_book_by_patron("222222", book_id)[0] is True
+    assert get_book_by_id(book_id)["available_copies"] == 1
+
 def test_borrow_success_updates_available_and_message():
     """Tests that a successful borrow operation returns True and includes a success message"""
     s1, m1 = borrow_book_by_patron("222222", 10)
@@ -158,6 +220,33 @@ def test_return_book_not_borrowed_by_patron():
     else:
         assert ("not borrowed" in message.lower()) or ("no record" in message.lower()) or ("not found" in message.lower())
 
+def test_return_restocks_and_closes_borrow():
+    """A return closes the borrow and gives the copy back, once."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 2)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    assert borrow_book_by_patron("222222", book_id)[0] is True
+    assert get_book_by_isbn("1234567890123")["available_copies"] == 1
+
+    success, message = return_book_by_patron("222222", book_id)
+    assert success is True and "on time" in message.lower()
+    assert get_book_by_isbn("1234567890123")["available_copies"] == 2
+
+    success, message = return_book_by_patron("222222", book_id)
+    assert success is False and "no active borrow" in message.lower()
+
+def test_return_reports_late_fee():
+    """Returning an overdue book reports the late fee owed."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 2)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    now = datetime.now()
+    insert_borrow_record("222222", book_id, now - timedelta(days=24), now - timedelta(days=10))
+
+    success, message = return_book_by_patron("222222", book_id)
+    assert success is True
+    assert "10 day(s) overdue" in message and "$6.50" in message
+    # Availability never exceeds total copies
+    assert get_book_by_isbn("1234567890123")["available_copies"] == 2
+
 
 # ----------------
 # R5 – Late Fee API
@@ -197,6 +286,22 @@ def test_latefee_cap_at_reasonable_max():
     assert isinstance(result.get("fee_amount", 0), (int, float))
     assert result["fee_amount"] <= 15.00
 
+def test_latefee_reads_active_then_returned_record():
+    """Fee is computed as of today while active, and frozen at the return date."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 2)
+    book_id = get_book_by_isbn("1234567890123")["id"]
+    now = datetime.now()
+    insert_borrow_record("444444", book_id, now - timedelta(days=17), now - timedelta(days=3))
+
+    result = calculate_late_fee_for_book("444444", book_id)
+    assert (result["days_overdue"], result["fee_amount"]) == (3, 1.50)
+    assert result["status"].startswith("Not yet returned")
+
+    assert return_book_by_patron("444444", book_id)[0] is True
+    result = calculate_late_fee_for_book("444444", book_id)
+    assert (result["days_overdue"], result["fee_amount"]) == (3, 1.50)
+    assert result["status"].startswith("Returned")
+
 # ----------------
 # R6 – Search
 # ----------------
@@ -227,6 +332,49 @@ def test_search_invalid_type_defaults_or_handles():
     books = search_books_in_catalog("clean", "unknown")
     assert isinstance(books, list)
 
+def test_search_finds_seeded_book_by_each_type():
+    """Title/author partial matches and exact ISBN match hit the catalog."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 3)
+    assert [b["isbn"] for b in search_books_in_catalog("CLEAN", "title")] == ["1234567890123"]
+    assert [b["isbn"] for b in search_books_in_catalog("martin", "author")] == ["1234567890123"]
+    assert [b["isbn"] for b in search_books_in_catalog("1234567890123", "isbn")] == ["1234567890123"]
+    assert search_books_in_catalog("123456789012", "isbn") == []
+    assert [b["isbn"] for b in search_books_in_catalog("MARTIN", "unknown")] == ["1234567890123"]
+
+def test_search_matches_inside_words():
+    """Partial matches are substrings, not just word prefixes."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 3)
+    assert len(search_books_in_catalog("ean co", "title")) == 1
+    assert len(search_books_in_catalog("rt", "author")) == 1
+
+def test_search_wildcards_are_literal():
+    """LIKE wildcards in the search term are matched literally."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 3)
+    assert search_books_in_catalog("%", "title") == []
+    assert search_books_in_catalog("_", "author") == []
+
+def test_search_folds_case_beyond_ascii():
+    """Accented titles and authors match regardless of case."""
+    add_book_to_catalog("École Normale", "Émile Zola", "1234567890123", 1)
+    for term in ("école", "ÉCOLE", "cole norm"):
+        assert [b["isbn"] for b in search_books_in_catalog(term, "title")] == ["1234567890123"]
+    for term in ("émile", "ÉMILE ZOLA"):
+        assert [b["isbn"] for b in search_books_in_catalog(term, "author")] == ["1234567890123"]
+    assert len(search_books_in_catalog("é", "unknown")) == 1
+    assert search_books_in_catalog("émile", "title") == []
+
+def test_init_database_rejects_sqlite_without_trigram(monkeypatch):
+    """An SQLite too old for the trigram tokenizer fails with a clear error."""
+    monkeypatch.setattr(database.sqlite3, "sqlite_version_info", (3, 33, 0))
+    with pytest.raises(RuntimeError, match="trigram"):
+        database.init_database()
+
+def test_search_quotes_in_term_are_literal():
+    """Double quotes in the term don't break the full-text query."""
+    add_book_to_catalog('The "Pragmatic" Programmer', "Hunt", "1234567890123", 1)
+    assert len(search_books_in_catalog('"pragmatic"', "title")) == 1
+    assert search_books_in_catalog('"nope', "title") == []
+
 # ----------------
 # R7 – Patron Status
 # ----------------
@@ -265,4 +413,18 @@ def test_patron_status_currently_borrowed_list():
     report = patron_status_report("123456")
     assert isinstance(report.get("currently_borrowed"), list)
 
-
+def test_patron_status_fees_follow_schedule():
+    """Fees per active loan follow the R5 schedule and are totalled."""
+    add_book_to_catalog("Clean Code", "Robert C. Martin", "1234567890123", 3)
+    add_book_to_catalog("Refactoring", "Martin Fowler", "1111111111111", 3)
+    now = datetime.now()
+    for isbn, days_late in (("1234567890123", 10), ("1111111111111", 30)):
+        book_id = get_book_by_isbn(isbn)["id"]
+        insert_borrow_record("333333", book_id, now - timedelta(days=14 + days_late),
+                             now - timedelta(days=days_late))
+
+    report = patron_status_report("333333")
+    fees = {b["title"]: (b["days_overdue"], b["late_fee"]) for b in report["currently_borrowed"]}
+    assert fees == {"Clean Code": (10, 6.50), "Refactoring": (30, 15.00)}
+    assert report["total_late_fees_owed"] == 21.50
+    assert report["num_currently_borrowed"] == 2
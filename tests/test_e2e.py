@@ -8,9 +8,31 @@ TEST_ISBN = "9100123456789"
 @pytest.fixture(scope="session", autouse=True)
 def headless_override(browser_type_launch_args):
     browser_type_launch_args["headless"] = True
+    browser_type_launch_args["args"] = [
+        *browser_type_launch_args.get("args", []), "--disable-dev-shm-usage"
+    ]
     return browser_type_launch_args
 
 
+@pytest.fixture(scope="module")
+def seeded_book(playwright):
+    # Add the test book by posting the add_book form directly (no browser)
+    api = playwright.request.new_context(base_url=BASE_URL)
+    try:
+        response = api.post("/add_book", form={
+            "title": "E2E Testing Book",
+            "author": "Michael Jin",
+            "isbn": TEST_ISBN,
+            "total_copies": "5",
+        })
+        # On success the form redirects to the catalog with a success flash
+        assert response.ok, f"seeding failed: HTTP {response.status}"
+        assert response.url.endswith("/catalog"), f"seeding failed: ended on {response.url}"
+        assert "successfully added" in response.text()
+    finally:
+        api.dispose()
+
+
 def test_add_book_appears_in_catalog(page: Page):
 
     page.goto(f"{BASE_URL}/add_book")
@@ -32,19 +54,7 @@ def test_add_book_appears_in_catalog(page: Page):
     expect(book_row).to_be_visible()
 
 
-def test_borrow_book_updates_availability(page: Page):
-
-    
-    page.goto(f"{BASE_URL}/add_book")
-
-    page.fill("input[name='title']", "E2E Testing Book")
-    page.fill("input[name='author']", "Michael Jin")
-
-
-    page.fill("input[name='isbn']", TEST_ISBN)
-
-    page.fill("input[name='total_copies']", "5")
-    page.click("button[type='submit']")
+def test_borrow_book_updates_availability(page: Page, seeded_book):
 
     page.goto(f"{BASE_URL}/catalog")
 
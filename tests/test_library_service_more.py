@@ -1,172 +1,214 @@
 import pytest
-from datetime import datetime, timedelta
+from datetime import timedelta
+
+from tests._clock import FROZEN_NOW
 
 # Unit under test
 from services.library_service import (
     add_book_to_catalog,
     borrow_book_by_patron,
+    borrow_books_bulk,
     return_book_by_patron,
     calculate_late_fee_for_book,
     search_books_in_catalog,
     get_patron_status_report,
 )
 
+# The session clock frozen by conftest; borrow rows carry dates,
+# the R7 row an ISO string
+_TODAY = FROZEN_NOW.date()
+_PAST_1D = _TODAY - timedelta(days=1)
+_PAST_3D_ISO = (_TODAY - timedelta(days=3)).isoformat()
+_PAST_8D = _TODAY - timedelta(days=8)
+_PAST_9D = _TODAY - timedelta(days=9)
+_PAST_10D = _TODAY - timedelta(days=10)
+
+
+def _two_shot(first, second):
+    # side_effect callable for a mock that is hit exactly twice
+    it = iter((first, second))
+    return lambda *_, **__: next(it)
+
 # ---------- R1: add_book_to_catalog ----------
 
-def test_add_book_existing_path_returns_true(mocker):
+def test_add_book_existing_path_returns_true(lib_mocks):
     # cover the "existing = get_book_by_isbn(...); if existing: return True, ..." branch
-    mocker.patch("services.library_service.get_book_by_isbn", return_value={"isbn": "1234567890123"})
+    lib_mocks.get_book_by_isbn.return_value = {"isbn": "1234567890123"}
     ok, msg = add_book_to_catalog("Clean Code", "Robert Martin", "1234567890123", 3)
     assert ok is True
     assert "successfully added" in msg.lower()
 
-def test_add_book_insert_and_availability_success(mocker):
-    mocker.patch("services.library_service.get_book_by_isbn", return_value=None)
-    ins = mocker.patch("services.library_service.insert_book", return_value=True)
+def test_add_book_insert_and_availability_success(lib_mocks):
+    lib_mocks.get_book_by_isbn.return_value = None
+    lib_mocks.insert_book.return_value = True
     ok, msg = add_book_to_catalog("Refactoring", "Martin Fowler", "1111111111111", 2)
     assert ok is True
-    ins.assert_called_once()
+    lib_mocks.insert_book.assert_called_once()
 
-def test_add_book_insert_fail(mocker):
-    mocker.patch("services.library_service.get_book_by_isbn", return_value=None)
-    mocker.patch("services.library_service.insert_book", return_value=False)
+def test_add_book_insert_fail(lib_mocks):
+    lib_mocks.get_book_by_isbn.return_value = None
+    lib_mocks.insert_book.return_value = False
     ok, msg = add_book_to_catalog("X", "Y", "2222222222222", 1)
     assert ok is False and "database error" in msg.lower()
 
 # ---------- R3: borrow_book_by_patron ----------
 
-def test_borrow_book_not_available_branch(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"title": "X", "available_copies": 0})
+def test_borrow_book_not_found_skips_patron_count(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = None
+    ok, msg = borrow_book_by_patron("123456", 10)
+    assert ok is False and msg == "Book not found."
+    lib_mocks.get_patron_borrow_count.assert_not_called()
+
+def test_borrow_book_not_available_branch(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 0}
     ok, msg = borrow_book_by_patron("123456", 10)
     assert ok is False and "not available" in msg.lower()
 
-def test_borrow_limit_reached_branch(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=5)
+def test_borrow_limit_reached_branch(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 1}
+    lib_mocks.get_patron_borrow_count.return_value = 5
     ok, msg = borrow_book_by_patron("123456", 10)
     assert ok is False and "maximum borrowing limit" in msg.lower()
 
-def test_borrow_insert_record_fail_branch(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=False)
+def test_borrow_write_fail_branch(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 1}
+    lib_mocks.get_patron_borrow_count.return_value = 0
+    lib_mocks.borrow_books_atomic.return_value = False
     ok, msg = borrow_book_by_patron("123456", 10)
     assert ok is False and "creating borrow record" in msg.lower()
 
-def test_borrow_update_availability_fail_branch(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=False)
-    ok, msg = borrow_book_by_patron("123456", 10)
-    assert ok is False and "updating book availability" in msg.lower()
-
-def test_borrow_success_happy_path(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+def test_borrow_success_happy_path(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 1}
+    lib_mocks.get_patron_borrow_count.return_value = 0
+    lib_mocks.borrow_books_atomic.return_value = True
     ok, msg = borrow_book_by_patron("123456", 10)
     assert ok is True and "successfully borrowed" in msg.lower()
+    lib_mocks.borrow_books_atomic.assert_called_once()
+
+def test_borrow_rechecks_after_write_conflict(lib_mocks):
+    # the last copy went to another patron between the check and the write
+    lib_mocks.get_book_by_id.side_effect = _two_shot({"title": "X", "available_copies": 1},
+                                                     {"title": "X", "available_copies": 0})
+    lib_mocks.get_patron_borrow_count.return_value = 0
+    lib_mocks.borrow_books_atomic.return_value = None
+    ok, msg = borrow_book_by_patron("123456", 10)
+    assert ok is False and "not available" in msg.lower()
+    lib_mocks.borrow_books_atomic.assert_called_once()
+
+def test_borrow_repeated_conflict_reports_current_state(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 1}
+    # another borrow fills the patron's limit before the final re-check
+    lib_mocks.get_patron_borrow_count.side_effect = [0, 0, 5]
+    lib_mocks.borrow_books_atomic.return_value = None
+    ok, msg = borrow_book_by_patron("123456", 10)
+    assert ok is False and "maximum borrowing limit" in msg.lower()
+    assert lib_mocks.borrow_books_atomic.call_count == 2
+
+def test_borrow_repeated_conflict_asks_to_retry(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X", "available_copies": 1}
+    lib_mocks.get_patron_borrow_count.return_value = 0
+    lib_mocks.borrow_books_atomic.return_value = None
+    ok, msg = borrow_book_by_patron("123456", 10)
+    assert ok is False and "try again" in msg.lower()
+    assert "database error" not in msg.lower()
+
+def test_borrow_bulk_db_failure_fails_accepted_only(lib_mocks):
+    lib_mocks.get_book_by_id.side_effect = _two_shot({"title": "X", "available_copies": 1}, None)
+    lib_mocks.get_patron_borrow_count.return_value = 0
+    lib_mocks.borrow_books_atomic.return_value = False
+    out = borrow_books_bulk("123456", [10, 11])
+    assert out[0] == (False, "Database error occurred while creating borrow record.")
+    assert out[1] == (False, "Book not found.")
 
 # ---------- R4: return_book_by_patron ----------
 
-def test_return_no_active_record_branch(mocker):
-    mocker.patch("services.library_service.get_book_by_id", return_value={"title": "X"})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=False)
+def test_return_no_active_record_branch(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X"}
+    lib_mocks.return_borrowed_book.return_value = None
     ok, msg = return_book_by_patron("123456", 10)
     assert ok is False and "no active borrow" in msg.lower()
 
-def test_return_update_book_not_found_on_second_fetch(mocker):
-    # First fetch succeeds, second fetch after update fails
-    mocker.patch("services.library_service.get_book_by_id",
-                 side_effect=[{"title": "X"}, None])
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value={"due_date": (datetime.now() - timedelta(days=1)).isoformat()})
+def test_return_database_error_branch(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X"}
+    lib_mocks.return_borrowed_book.return_value = False
     ok, msg = return_book_by_patron("123456", 10)
-    assert ok is False and "not found during update" in msg.lower()
-
-def test_return_update_availability_error_branch(mocker):
-    # Second fetch shows available < total, but update_book_availability fails
-    mocker.patch("services.library_service.get_book_by_id",
-                 side_effect=[{"title": "X"},
-                              {"total_copies": 3, "available_copies": 2}])
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value={"due_date": (datetime.now() - timedelta(days=1)).isoformat()})
-    mocker.patch("services.library_service.update_book_availability", return_value=False)
-    ok, msg = return_book_by_patron("123456", 10)
-    assert ok is False and "database error while updating book availability" in msg.lower()
-
-def test_return_overdue_fee_path_success(mocker):
-    past_due = (datetime.now() - timedelta(days=10)).isoformat()
-    mocker.patch("services.library_service.get_book_by_id",
-                 side_effect=[{"title": "X"},
-                              {"total_copies": 3, "available_copies": 2}])
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value={"due_date": past_due})
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    assert ok is False and "database error while recording the return" in msg.lower()
+
+def test_return_overdue_fee_path_success(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X"}
+    lib_mocks.return_borrowed_book.return_value = {"id": 1, "due_date": _PAST_10D}
     ok, msg = return_book_by_patron("123456", 10)
     assert ok is True and "late fee" in msg.lower()
 
-def test_return_due_date_parse_exception_falls_back_to_no_fee(mocker):
-    # Force the try/except block by giving a malformed due_date
-    mocker.patch("services.library_service.get_book_by_id",
-                 side_effect=[{"title": "X"},
-                              {"total_copies": 2, "available_copies": 1}])
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value={"due_date": object()})  # not parseable -> triggers except: pass
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+def test_return_due_today_has_no_fee(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"title": "X"}
+    lib_mocks.return_borrowed_book.return_value = {"id": 1, "due_date": _TODAY}
     ok, msg = return_book_by_patron("123456", 10)
     assert ok is True and "no late fee" in msg.lower()
 
 # ---------- R5: calculate_late_fee_for_book ----------
 
-def test_calc_fee_not_returned_positive_fee(mocker):
+def test_calc_fee_not_returned_positive_fee(lib_mocks):
     # active borrow with due date in the past (no return_date) -> "Not yet returned" path
-    mocker.patch("services.library_service.get_book_by_id", return_value={"id": 1})
-    row = {"due_date": (datetime.now() - timedelta(days=9)).isoformat()}  # 9 days overdue -> fee > 0
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=row)
+    lib_mocks.get_book_by_id.return_value = {"id": 1}
+    row = {"due_date": _PAST_9D, "return_date": None}  # 9 days overdue -> fee > 0
+    lib_mocks.get_active_borrow_record.return_value = row
     out = calculate_late_fee_for_book("123456", 10)
     assert out["fee_amount"] > 0
     assert out["status"].startswith("Not yet returned")
 
-def test_calc_fee_returned_historical_fee(mocker):
-    mocker.patch("services.library_service.get_book_by_id", return_value={"id": 1})
+def test_calc_fee_returned_historical_fee(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"id": 1}
     row = {
-        "due_date": (datetime.now() - timedelta(days=8)).isoformat(),
-        "return_date": (datetime.now() - timedelta(days=1)).isoformat(),
+        "due_date": _PAST_8D,
+        "return_date": _PAST_1D,
     }
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=row)
+    lib_mocks.get_active_borrow_record.return_value = row
     out = calculate_late_fee_for_book("123456", 10)
     assert out["fee_amount"] > 0
     assert out["status"].startswith("Returned")
 
+def test_calc_fee_no_borrow_record(lib_mocks):
+    lib_mocks.get_book_by_id.return_value = {"id": 1}
+    lib_mocks.get_active_borrow_record.return_value = None
+    out = calculate_late_fee_for_book("123456", 10)
+    assert out["fee_amount"] == 0.00
+    assert "no active/known borrow record" in out["status"].lower()
+
+@pytest.mark.parametrize("days, fee", [(0, 0.00), (1, 0.50), (7, 3.50), (8, 4.50), (19, 15.00), (40, 15.00)])
+def test_calc_fee_schedule_tiers_and_cap(lib_mocks, days, fee):
+    lib_mocks.get_book_by_id.return_value = {"id": 1}
+    row = {"due_date": _TODAY - timedelta(days=days), "return_date": None}
+    lib_mocks.get_active_borrow_record.return_value = row
+    out = calculate_late_fee_for_book("123456", 10)
+    assert out["days_overdue"] == days
+    assert out["fee_amount"] == fee
+
 # ---------- R6: search_books_in_catalog (hit branches quickly) ----------
 
-def test_search_books_fallback_branch(mocker):
-    books = [
-        {"title": "Clean Code", "author": "Martin", "isbn": "1111111111111"},
-        {"title": "Design Patterns", "author": "GoF", "isbn": "2222222222222"},
-    ]
-    mocker.patch("services.library_service.get_all_books", return_value=books)
-    # unknown search_type -> fallback (title OR author)
-    assert len(search_books_in_catalog("martin", "unknown")) == 1
+def test_search_books_fallback_branch(lib_mocks):
+    books = [{"title": "Clean Code", "author": "Martin", "isbn": "1111111111111"}]
+    lib_mocks.search_books.return_value = books
+    # unknown search_type -> fallback (title OR author), passed through to SQL
+    assert search_books_in_catalog("  martin ", "unknown") == books
+    lib_mocks.search_books.assert_called_once_with("martin", "unknown")
 
 # ---------- R7: get_patron_status_report ----------
 
-def test_patron_status_with_overdue_fee_and_history(mocker):
-    today = datetime.now().date()
-    overdue = (today - timedelta(days=3)).isoformat()
-    mocker.patch("services.library_service.get_patron_borrowed_books",
-                 return_value=[{"book_id": 1, "title": "X", "due_date": overdue}])
-    mocker.patch("services.library_service.get_patron_borrow_history",
-                 return_value=[{"book_id": 1, "returned": True}])
+def test_patron_status_with_overdue_fee_and_history(lib_mocks):
+    lib_mocks.get_patron_active_with_fees.return_value = [
+        {"book_id": 1, "title": "X", "due_date": _PAST_3D_ISO, "days_overdue": 3, "late_fee": 1.50}
+    ]
+    lib_mocks.get_patron_borrow_history.return_value = [{"book_id": 1, "returned": True}]
     out = get_patron_status_report("123456")
     assert out["num_currently_borrowed"] == 1
-    assert out["total_late_fees_owed"] > 0
+    assert out["total_late_fees_owed"] == 1.50
     assert out["status"] == "Complete"
+    lib_mocks.get_patron_active_with_fees.assert_called_once_with("123456", _TODAY)
+
+def test_patron_status_no_loans_reports_float_total(lib_mocks):
+    lib_mocks.get_patron_active_with_fees.return_value = []
+    lib_mocks.get_patron_borrow_history.return_value = []
+    out = get_patron_status_report("123456")
+    assert out["total_late_fees_owed"] == 0.0
+    assert isinstance(out["total_late_fees_owed"], float)